@@ -1,8 +1,7 @@
 import calendar
 import concurrent.futures
 import os
-import random
-import time
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from logging import getLogger
@@ -34,6 +33,22 @@ logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 app = Chalice(app_name='harvest')
 app.log.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 cloudfront = boto3.client('cloudfront')
+sqs = boto3.client('sqs')
+
+# Recorder.save でパーティションを並列に保存する際のスレッド数。
+# render_* 自体も並列に実行されるので、合計が S3 のコネクションプール
+# (storage.s3_config の max_pool_connections) に収まるようにしておく。
+RECORDER_SAVE_WORKERS = 4
+
+# boto3 の client の生成コストは無視できないので、
+# warm start 時も含めて AmazonS3Storage を使い回す。
+_s3_storage: storage.AmazonS3Storage | None = None
+_s3_storage_lock = threading.Lock()
+
+# 設定ファイル類は小さく、定期実行のたびに読み込まれるので
+# /tmp にキャッシュする (warm start の間は保持される)。
+SETTINGS_CACHE_DIR = '/tmp/harvest/settings'
+_settings_storage: storage.AmazonS3Storage | None = None
 
 cors_config = CORSConfig(
     allow_origin=settings.CORSAllowOrigin,
@@ -44,6 +59,28 @@ cors_config = CORSConfig(
 )
 
 
+def get_s3_storage() -> storage.AmazonS3Storage:
+    global _s3_storage
+    with _s3_storage_lock:
+        if _s3_storage is None:
+            _s3_storage = storage.AmazonS3Storage(
+                settings.S3Bucket,
+                compress=True,
+            )
+        return _s3_storage
+
+
+def get_settings_storage() -> storage.AmazonS3Storage:
+    global _settings_storage
+    with _s3_storage_lock:
+        if _settings_storage is None:
+            _settings_storage = storage.AmazonS3Storage(
+                settings.S3Bucket,
+                cachedir=SETTINGS_CACHE_DIR,
+            )
+        return _settings_storage
+
+
 def setup_graphql_client() -> graphql.GraphQLClient:
     return graphql.GraphQLClient(
         endpoint=settings.GraphQLEndpoint,
@@ -51,6 +88,18 @@ def setup_graphql_client() -> graphql.GraphQLClient:
     )
 
 
+def wait_for_procs(procs: list[concurrent.futures.Future]) -> None:
+    """
+        すべての Future の完了を待ち、例外が発生していれば送出する。
+    """
+    done, not_done = concurrent.futures.wait(procs)
+    app.log.info("done: %s", done)
+    app.log.info("not_done: %s", not_done)
+    for ft in done:
+        # 例外を握りつぶさないように結果を取り出す
+        ft.result()
+
+
 def render_date_contents(
     reports: list[model.RunReport],
     skip_target_date: date,
@@ -61,7 +110,7 @@ def render_date_contents(
     recorder = recording.Recorder(
         partitioningRule=recording.PartitioningRuleByDate(),
         skipSaveRule=recording.SkipSaveRuleByDate(skip_target_date),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -72,13 +121,23 @@ def render_date_contents(
     recorder.add_all(reports)
 
     if recorder.count():
-        recorder.save(force=force_save, ignore_original=ignore_original)
+        recorder.save(
+            force=force_save,
+            ignore_original=ignore_original,
+            max_workers=RECORDER_SAVE_WORKERS,
+        )
 
     latestDatePageBuilder = recording.LatestDatePageBuilder(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
     )
-    latestDatePageBuilder.build()
+    # 当日分を書き込んだのであれば、それが最新であることは明らかなので
+    # 最新ページの探索を省略できる。
+    today = timezone.now().date().isoformat()
+    if today in recorder.saved_keys:
+        latestDatePageBuilder.build_from(today)
+    else:
+        latestDatePageBuilder.build()
 
 
 def render_user_contents(
@@ -91,7 +150,7 @@ def render_user_contents(
     recorder = recording.Recorder(
         partitioningRule=recording.PartitioningRuleByUser(),
         skipSaveRule=recording.SkipSaveRuleByDateAndUser(skip_target_date),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -102,12 +161,16 @@ def render_user_contents(
     recorder.add_all(reports)
 
     if recorder.count():
-        recorder.save(force=force_save, ignore_original=ignore_original)
+        recorder.save(
+            force=force_save,
+            ignore_original=ignore_original,
+            max_workers=RECORDER_SAVE_WORKERS,
+        )
 
     recorder_byuserlist = recording.Recorder(
         partitioningRule=recording.PartitioningRuleByUserList(),
         skipSaveRule=recording.SkipSaveRuleNeverMatch(),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -130,7 +193,7 @@ def render_quest_contents(
     recorder = recording.Recorder(
         partitioningRule=recording.PartitioningRuleByQuest(),
         skipSaveRule=recording.SkipSaveRuleByDateAndQuest(skip_target_date),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -141,7 +204,11 @@ def render_quest_contents(
     recorder.add_all(reports)
 
     if recorder.count():
-        recorder.save(force=force_save, ignore_original=ignore_original)
+        recorder.save(
+            force=force_save,
+            ignore_original=ignore_original,
+            max_workers=RECORDER_SAVE_WORKERS,
+        )
 
     recorder_byquestlist = recording.Recorder(
         # この partitioningRule は rebuild フラグを個別に渡す必要あり
@@ -149,7 +216,7 @@ def render_quest_contents(
             ignore_original,
         ),
         skipSaveRule=recording.SkipSaveRuleNeverMatch(),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -172,7 +239,7 @@ def render_1hrun_contents(
     recorder = recording.Recorder(
         partitioningRule=recording.PartitioningRuleBy1HRun(calendar.THURSDAY),
         skipSaveRule=recording.SkipSaveRuleByDate(skip_target_date),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -183,14 +250,18 @@ def render_1hrun_contents(
     recorder.add_all(reports)
 
     if recorder.count():
-        recorder.save(force=force_save, ignore_original=ignore_original)
+        recorder.save(
+            force=force_save,
+            ignore_original=ignore_original,
+            max_workers=RECORDER_SAVE_WORKERS,
+        )
 
     recorder_by1hrunlist = recording.Recorder(
         partitioningRule=recording.PartitioningRuleBy1HRunWeekList(
             start_day=calendar.THURSDAY,
         ),
         skipSaveRule=recording.SkipSaveRuleNeverMatch(),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -208,7 +279,7 @@ def render_error_contents(
 ) -> None:
     outdir = f'{settings.ProcessorOutputDir}/errors'
     recorder = recording.ErrorPageRecorder(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         key='error',
         formats=(
@@ -227,12 +298,43 @@ def render_contents(
     skip_target_date: date,
     ignore_original: bool = False,
 ) -> None:
-    render_date_contents(reports, skip_target_date, ignore_original=ignore_original)
-    render_user_contents(reports, skip_target_date, ignore_original=ignore_original)
-    render_quest_contents(reports, skip_target_date, ignore_original=ignore_original)
-    render_1hrun_contents(reports, skip_target_date, ignore_original=ignore_original)
+    # 各 render は互いに独立しており S3 の I/O 待ちが支配的なので並列に実行する
+    # (AmazonS3Storage はスレッドセーフな boto3 client のみを使うので
+    # スレッド間で共有して問題ない)
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        procs = [
+            executor.submit(
+                render_date_contents,
+                reports,
+                skip_target_date,
+                ignore_original=ignore_original,
+            ),
+            executor.submit(
+                render_user_contents,
+                reports,
+                skip_target_date,
+                ignore_original=ignore_original,
+            ),
+            executor.submit(
+                render_quest_contents,
+                reports,
+                skip_target_date,
+                ignore_original=ignore_original,
+            ),
+            executor.submit(
+                render_1hrun_contents,
+                reports,
+                skip_target_date,
+                ignore_original=ignore_original,
+            ),
+            executor.submit(
+                render_error_contents,
+                errors,
+                ignore_original=ignore_original,
+            ),
+        ]
+        wait_for_procs(procs)
 
-    render_error_contents(errors, ignore_original=ignore_original)
     app.log.info('done')
 
 
@@ -254,7 +356,7 @@ def render_month_contents(
     recorder = recording.Recorder(
         partitioningRule=recording.PartitioningRuleByMonth(),
         skipSaveRule=recording.SkipSaveRuleByDateRange(skip_target_date, last_day_of_prev_month),
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
         formats=(
             recording.OutputFormat.JSON,
@@ -266,12 +368,16 @@ def render_month_contents(
 
     if recorder.count():
         # original への追記はせず、常に上書き
-        recorder.save(force=force_save, ignore_original=True)
+        recorder.save(
+            force=force_save,
+            ignore_original=True,
+            max_workers=RECORDER_SAVE_WORKERS,
+        )
 
     # month の HTML レンダリングが完了してからでないと実行できない。
     # したがってこの位置で実行する。
     latestMonthPageBuilder = recording.LatestMonthPageBuilder(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=outdir,
     )
     latestMonthPageBuilder.build()
@@ -291,20 +397,20 @@ def collect_reports(event):
     agent = setup_graphql_client()
 
     report_repository = repository.ReportRepository(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.ReportStorageDir,
     )
 
     last_report_ts_retriever = repository.LastReportTimeStamp(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_settings_storage(),
         basedir=settings.SettingsDir,
         key=settings.LastReportTimeFile,
     )
 
-    if last_report_ts_retriever.exists():
+    try:
         last_report_id, since = last_report_ts_retriever.load()
         app.log.info(f"load last_report_ts from S3: report_id = {last_report_id}, timestamp = {since}")
-    else:
+    except repository.FileNotFound:
         last_report_id = ""
         # Twitter Crawling の停止時刻
         since = datetime(2023, 6, 13, 20, 35, 0, tzinfo=timezone.Local)
@@ -318,7 +424,11 @@ def collect_reports(event):
     if len(reports) == 0:
         return
 
-    if len(reports) == 1 and reports[0].report_id == last_report_id:
+    # timestamp が since と一致するレポート (= 前回取得済みの最新レポート) も
+    # 取得されるので取り除いておく。残しておくと quest list の countup が
+    # 重複してしまう。
+    reports = [r for r in reports if r.report_id != last_report_id]
+    if len(reports) == 0:
         app.log.info('no new reports')
         return
 
@@ -335,12 +445,14 @@ def collect_reports(event):
 
     # 定期収集において bydate の render を制限する必要はない
     skip_target_date = date(2000, 1, 1)
-    render_date_contents(reports, skip_target_date)
-    render_user_contents(reports, skip_target_date)
-    render_quest_contents(reports, skip_target_date)
-    render_1hrun_contents(reports, skip_target_date)
-
-    app.log.info('done')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        procs = [
+            executor.submit(render_date_contents, reports, skip_target_date),
+            executor.submit(render_user_contents, reports, skip_target_date),
+            executor.submit(render_quest_contents, reports, skip_target_date),
+            executor.submit(render_1hrun_contents, reports, skip_target_date),
+        ]
+        wait_for_procs(procs)
 
 
 @app.lambda_function()
@@ -360,25 +472,34 @@ def rebuild_outputs(event, context):
     app.log.info("skip rebuilding before the target date: %s", skip_target_date)
 
     tweet_repository = repository.TweetRepository(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.TweetStorageDir,
     )
 
     censored_accounts = twitter.CensoredAccounts(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_settings_storage(),
         filepath=f'{settings.SettingsDir}/{settings.CensoredAccountsFile}',
     )
 
     report_repository = repository.ReportRepository(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.ReportStorageDir,
     )
 
-    twitter_reports, errors = tweet_repository.readall(set(censored_accounts.list()))
-    app.log.info(f'retrieved {len(twitter_reports)} reports, {len(errors)} parse error tweets from twitter archive')
+    # twitter archive と fgodrop archive の読み込みは互いに独立しているので並列に行う
+    # 両者は同じ AmazonS3Storage を共有するが、list/streams も client 経由なので問題ない
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ft_twitter = executor.submit(
+            tweet_repository.readall,
+            set(censored_accounts.list()),
+        )
+        ft_fgodrop = executor.submit(report_repository.readall)
+
+        twitter_reports, errors = ft_twitter.result()
+        app.log.info(f'retrieved {len(twitter_reports)} reports, {len(errors)} parse error tweets from twitter archive')
 
-    fgodrop_reports = report_repository.readall()
-    app.log.info(f'retrieved {len(fgodrop_reports)} reports from fgodrop archive')
+        fgodrop_reports = ft_fgodrop.result()
+        app.log.info(f'retrieved {len(fgodrop_reports)} reports from fgodrop archive')
 
     # マージして新しい順に並べる
     reports = twitter_reports + fgodrop_reports
@@ -448,9 +569,7 @@ def rebuild_outputs(event, context):
         )
         procs.append(ft)
 
-        done, not_done = concurrent.futures.wait(procs)
-        app.log.info("done: %s", done)
-        app.log.info("not_done: %s", not_done)
+        wait_for_procs(procs)
 
     app.log.info('finished rebuilding outputs')
 
@@ -461,7 +580,7 @@ def merge_tweets_into_datefile(event):
     app.log.info("target date: %s", yesterday)
 
     merging.merge_into_datefile(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.ReportStorageDir,
         target_date=yesterday,
     )
@@ -475,7 +594,7 @@ def merge_tweets_into_monthfile(event):
     app.log.info("target month: %s", target_month)
 
     merging.merge_into_monthfile(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.ReportStorageDir,
         target_month=target_month,
     )
@@ -487,7 +606,7 @@ def merge_tweets_into_monthfile_manually(event, context):
     app.log.info("target month: %s", target_month)
 
     merging.merge_into_monthfile(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=settings.ReportStorageDir,
         target_month=target_month,
     )
@@ -510,7 +629,7 @@ def rebuild_month_summary(event):
 @app.lambda_function()
 def build_static_contents(event, context):
     renderer = static.StaticPagesRenderer(
-        fileStorage=storage.AmazonS3Storage(settings.S3Bucket),
+        fileStorage=get_s3_storage(),
         basedir=f'{settings.ProcessorOutputDir}/static',
     )
     renderer.render_all()
@@ -519,9 +638,7 @@ def build_static_contents(event, context):
 
 def generate_caller_reference():
     # unique であればよい
-    t = time.time()
-    r = random.randint(0, 1048576)
-    return f'harvest-{t}-{r}'
+    return f'harvest-{os.urandom(8).hex()}'
 
 
 # NOTE: 本来ここに実装すべきものではない。可能なら別リポジトリに切り出すべき。
@@ -546,11 +663,49 @@ def invalidate_cloudfront_cache(event, context):
         logger.info('ignore cache invalidation: probably blank html')
         return
 
-    items = []
     # .../index.html を invalidate する代わりに
     # .../ を invalidate する。
-    items.append(item[:item.rfind('/') + 1])
+    path = item[:item.rfind('/') + 1]
+
+    # rebuild 時などは大量の index.html が書き込まれるので、ここでは
+    # invalidation を発行せずキューに積むだけにする。
+    # 実際の invalidation は flush_cloudfront_invalidations でまとめて行う。
+    logger.info('enqueue cache invalidation: %s', path)
 
+    sqs.send_message(
+        QueueUrl=settings.InvalidationQueueUrl,
+        MessageBody=path,
+    )
+
+
+# 1回の invalidation で指定できるパス数の上限
+MAX_INVALIDATION_PATHS = 3000
+
+
+@app.schedule(Rate(1, unit=Rate.MINUTES))
+def flush_cloudfront_invalidations(event):
+    paths: set[str] = set()
+    receipt_handles: list[str] = []
+
+    while len(receipt_handles) < MAX_INVALIDATION_PATHS:
+        # 1回で最大10件返ってくるので、上限を超えないように残り件数で抑える
+        resp = sqs.receive_message(
+            QueueUrl=settings.InvalidationQueueUrl,
+            MaxNumberOfMessages=min(10, MAX_INVALIDATION_PATHS - len(receipt_handles)),
+            WaitTimeSeconds=0,
+        )
+        messages = resp.get('Messages', [])
+        if len(messages) == 0:
+            break
+        for message in messages:
+            paths.add(message['Body'])
+            receipt_handles.append(message['ReceiptHandle'])
+
+    if len(paths) == 0:
+        logger.info('no pending cache invalidation')
+        return
+
+    items = sorted(paths)
     logger.info('cache invalidation: %s', items)
 
     cloudfront.create_invalidation(
@@ -563,3 +718,22 @@ def invalidate_cloudfront_cache(event, context):
             'CallerReference': generate_caller_reference(),
         }
     )
+
+    # invalidation の発行に成功したものだけをキューから削除する。
+    # 失敗した場合は visibility timeout 経過後に再度取り出される。
+    # 削除に失敗したものは再度取り出されて invalidation が重複するだけなので、
+    # 警告を出すにとどめる。
+    for i in range(0, len(receipt_handles), 10):
+        resp = sqs.delete_message_batch(
+            QueueUrl=settings.InvalidationQueueUrl,
+            Entries=[
+                {'Id': str(j), 'ReceiptHandle': handle}
+                for j, handle in enumerate(receipt_handles[i:i + 10])
+            ],
+        )
+        for failed in resp.get('Failed', []):
+            logger.warning(
+                'failed to delete invalidation message: %s %s',
+                failed['Code'],
+                failed.get('Message', ''),
+            )
@@ -0,0 +1,180 @@
+import json
+from datetime import datetime
+
+import botocore.exceptions  # type: ignore
+import pytest
+from botocore.stub import ANY, Stubber  # type: ignore
+
+import app
+from chalicelib import model, storage, timezone
+
+QUEUE_URL = 'https://sqs.ap-northeast-1.amazonaws.com/123456789012/invalidation'
+DISTRIBUTION_ID = 'EDFDVBD6EXAMPLE'
+
+
+@pytest.fixture
+def stubbers(monkeypatch):
+    monkeypatch.setattr(app.settings, 'InvalidationQueueUrl', QUEUE_URL)
+    monkeypatch.setattr(app.settings, 'CloudfrontDistributionId', DISTRIBUTION_ID)
+    with Stubber(app.sqs) as sqs, Stubber(app.cloudfront) as cloudfront:
+        yield sqs, cloudfront
+        sqs.assert_no_pending_responses()
+        cloudfront.assert_no_pending_responses()
+
+
+def _messages(paths: list[str], start: int = 0) -> dict:
+    return {
+        'Messages': [
+            {'Body': path, 'ReceiptHandle': f'h{start + i}'}
+            for i, path in enumerate(paths)
+        ],
+    }
+
+
+def _add_receive(sqs: Stubber, max_messages: int, response: dict) -> None:
+    sqs.add_response(
+        'receive_message',
+        response,
+        {
+            'QueueUrl': QUEUE_URL,
+            'MaxNumberOfMessages': max_messages,
+            'WaitTimeSeconds': 0,
+        },
+    )
+
+
+def _add_invalidation(cloudfront: Stubber, items: list[str]) -> None:
+    cloudfront.add_response(
+        'create_invalidation',
+        {},
+        {
+            'DistributionId': DISTRIBUTION_ID,
+            'InvalidationBatch': {
+                'Paths': {'Quantity': len(items), 'Items': items},
+                'CallerReference': ANY,
+            },
+        },
+    )
+
+
+def _add_delete(sqs: Stubber, handles: list[str], failed: list[dict] | None = None) -> None:
+    sqs.add_response(
+        'delete_message_batch',
+        {'Successful': [], 'Failed': failed or []},
+        {
+            'QueueUrl': QUEUE_URL,
+            'Entries': [
+                {'Id': str(i), 'ReceiptHandle': h} for i, h in enumerate(handles)
+            ],
+        },
+    )
+
+
+def test_flush_cloudfront_invalidations(stubbers):
+    sqs, cloudfront = stubbers
+    # 同じパスは1つにまとめられる
+    paths = [f'/p{i % 11}/' for i in range(13)]
+    _add_receive(sqs, 10, _messages(paths[:10]))
+    _add_receive(sqs, 10, _messages(paths[10:], start=10))
+    _add_receive(sqs, 10, {})
+    _add_invalidation(cloudfront, sorted(set(paths)))
+    # 削除は 10 件ずつ。失敗したものは警告のみ
+    _add_delete(sqs, [f'h{i}' for i in range(10)])
+    _add_delete(
+        sqs,
+        ['h10', 'h11', 'h12'],
+        failed=[{'Id': '0', 'SenderFault': False, 'Code': 'InternalError'}],
+    )
+
+    app.flush_cloudfront_invalidations.func(None)
+
+
+def test_flush_cloudfront_invalidations_limit(stubbers, monkeypatch):
+    sqs, cloudfront = stubbers
+    monkeypatch.setattr(app, 'MAX_INVALIDATION_PATHS', 12)
+    paths = [f'/p{i:02d}/' for i in range(12)]
+    # 残り件数を超えて取り出さず、上限に達したら receive をやめる
+    _add_receive(sqs, 10, _messages(paths[:10]))
+    _add_receive(sqs, 2, _messages(paths[10:], start=10))
+    _add_invalidation(cloudfront, paths)
+    _add_delete(sqs, [f'h{i}' for i in range(10)])
+    _add_delete(sqs, ['h10', 'h11'])
+
+    app.flush_cloudfront_invalidations.func(None)
+
+
+def test_flush_cloudfront_invalidations_error(stubbers):
+    sqs, cloudfront = stubbers
+    _add_receive(sqs, 10, _messages(['/a/']))
+    _add_receive(sqs, 10, {})
+    cloudfront.add_client_error('create_invalidation', 'TooManyInvalidationsInProgress')
+    # invalidation に失敗した場合はキューから削除しない (delete の stub なし)
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        app.flush_cloudfront_invalidations.func(None)
+
+
+def test_flush_cloudfront_invalidations_empty(stubbers):
+    sqs, cloudfront = stubbers
+    _add_receive(sqs, 10, {})
+
+    app.flush_cloudfront_invalidations.func(None)
+
+
+def _report(report_id: str, hour: int) -> model.RunReport:
+    return model.RunReport(
+        report_id=report_id,
+        tweet_id=None,
+        reporter="user1",
+        reporter_id="1",
+        reporter_name="",
+        chapter="キャメロット",
+        place="隠れ村",
+        runcount=10,
+        items={"ランプ": "1"},
+        note="",
+        timestamp=datetime(2023, 7, 5, hour, 0, 0, tzinfo=timezone.Local),
+        source="fgodrop",
+    )
+
+
+class _FakeAgent:
+    def __init__(self, reports: list[model.RunReport]):
+        self.reports = reports
+
+    def list_reports(self, timestamp: int) -> list[model.RunReport]:
+        # GraphQL API と同様に since と同時刻のものも返す
+        return [r for r in self.reports if r.timestamp.timestamp() >= timestamp]
+
+
+def test_collect_reports_skip_collected_report(tmp_path, monkeypatch):
+    fileStorage = storage.FilesystemStorage()
+    monkeypatch.setattr(app, 'get_s3_storage', lambda: fileStorage)
+    monkeypatch.setattr(app, 'get_settings_storage', lambda: fileStorage)
+    monkeypatch.setattr(app.settings, 'ReportStorageDir', str(tmp_path / 'reports'))
+    monkeypatch.setattr(app.settings, 'SettingsDir', str(tmp_path / 'settings'))
+    monkeypatch.setattr(app.settings, 'ProcessorOutputDir', str(tmp_path / 'contents'))
+    for d in ('reports', 'settings', 'contents/date', 'contents/user', 'contents/quest', 'contents/1hrun'):
+        (tmp_path / d).mkdir(parents=True)
+
+    def _collect(reports: list[model.RunReport]) -> list[str]:
+        for f in (tmp_path / 'reports').iterdir():
+            f.unlink()
+        monkeypatch.setattr(app, 'setup_graphql_client', lambda: _FakeAgent(reports))
+        app.collect_reports(None)
+        logged: list[str] = []
+        for f in (tmp_path / 'reports').iterdir():
+            logged.extend(e['id'] for e in json.loads(f.read_text()))
+        return sorted(logged)
+
+    def _quest_count() -> int:
+        quest_list = json.loads((tmp_path / 'contents/quest/all.json').read_text())
+        return sum(q['count'] for q in quest_list)
+
+    r1, r2, r3 = _report("1", 10), _report("2", 11), _report("3", 12)
+    assert _collect([r1, r2]) == ["1", "2"]
+    assert _quest_count() == 2
+
+    # 前回の最新レポート r2 は再度取得されるが、記録も countup もされない
+    assert _collect([r1, r2, r3]) == ["3"]
+    assert _quest_count() == 3
@@ -3,6 +3,7 @@ import csv
 import io
 import json
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from enum import Enum
 from logging import getLogger
@@ -15,6 +16,7 @@ from jinja2 import (  # type: ignore
     PackageLoader,
     select_autoescape,
 )
+import orjson
 
 from . import (
     freequest,
@@ -85,16 +87,25 @@ class SupportSkipSaveRule(Protocol):
 
 
 class PartitioningRuleByDate:
+    def __init__(self) -> None:
+        # YYYYMMDD -> YYYY-MM-DD
+        # isoformat() は日付の種類数だけ呼べばよい
+        self.date_keys: dict[int, str] = {}
+
     def dispatch(
         self,
         partitions: dict[str, list[model.SupportDictConversible]],
         report: model.RunReport,
     ) -> None:
 
-        date = report.timestamp.date().isoformat()
-        if date not in partitions:
-            partitions[date] = []
-        partitions[date].append(report)
+        # report ごとに呼ばれるので、関数呼び出しを避けて
+        # YYYYMMDD の int をその場で組み立てる
+        ts = report.timestamp
+        k = ts.year * 10000 + ts.month * 100 + ts.day
+        key = self.date_keys.get(k)
+        if key is None:
+            key = self.date_keys[k] = ts.date().isoformat()
+        partitions.setdefault(key, []).append(report)
 
 
 def get_week_start_day(target_date: date, start_day: int) -> date:
@@ -137,9 +148,7 @@ class PartitioningRuleBy1HRun:
         # ただ、指定する可能性はほぼないので考えないことにする。
         display_date = week_start + timedelta(days=5 - self.start_day)
         display_date_str = display_date.isoformat()
-        if display_date_str not in partitions:
-            partitions[display_date_str] = []
-        partitions[display_date_str].append(report)
+        partitions.setdefault(display_date_str, []).append(report)
 
 
 class PartitioningRuleByMonth:
@@ -149,10 +158,11 @@ class PartitioningRuleByMonth:
         report: model.RunReport,
     ) -> None:
 
-        month = report.timestamp.date().strftime(month_format)
-        if month not in partitions:
-            partitions[month] = []
-        partitions[month].append(report)
+        # month_format と同じ形式。report ごとに呼ばれるので、
+        # strftime よりも軽い f-string で組み立てる。
+        ts = report.timestamp
+        month = f'{ts.year:04d}-{ts.month:02d}'
+        partitions.setdefault(month, []).append(report)
 
 
 class PartitioningRuleByUser:
@@ -162,9 +172,7 @@ class PartitioningRuleByUser:
         report: model.RunReport,
     ) -> None:
 
-        if report.reporter not in partitions:
-            partitions[report.reporter] = []
-        partitions[report.reporter].append(report)
+        partitions.setdefault(report.reporter, []).append(report)
 
 
 class PartitioningRuleByQuest:
@@ -174,10 +182,7 @@ class PartitioningRuleByQuest:
         report: model.RunReport,
     ) -> None:
 
-        qid = report.quest_id
-        if qid not in partitions:
-            partitions[qid] = []
-        partitions[qid].append(report)
+        partitions.setdefault(report.quest_id, []).append(report)
 
 
 class UserListElement:
@@ -230,9 +235,7 @@ class PartitioningRuleByUserList:
         e = UserListElement(report.reporter)
 
         # パーティションは常に1つ
-        if 'all' not in partitions:
-            partitions['all'] = []
-        partitions['all'].append(e)
+        partitions.setdefault('all', []).append(e)
 
 
 class QuestListElement:
@@ -469,10 +472,7 @@ class PartitioningRuleBy1HRunWeekList:
         e = FGO1HRunWeekListElement(week_start, display_date)
 
         # パーティションは常に all のみ
-        if 'all' not in partitions:
-            partitions['all'] = []
-
-        partitions['all'].append(e)
+        partitions.setdefault('all', []).append(e)
 
 
 class SkipSaveRuleNeverMatch:
@@ -586,6 +586,8 @@ class Recorder:
         self.basedir = basedir
         self.formats = formats
         self.counter: int = 0
+        # save() で実際に書き込みを行った key
+        self.saved_keys: set[str] = set()
         self.basepath = fileStorage.path_object(self.basedir)
         # for SupportStatefulPartitioningRule
         if hasattr(self.partitioningRule, 'setup'):
@@ -622,44 +624,87 @@ class Recorder:
             return []
         return json.loads(text, object_hook=Recorder._load_hook)
 
-    def save(self, force: bool = False, ignore_original: bool = False):
-        for key, reports in self.partitions.items():
-            if len(reports) == 0:
-                continue
+    def _save_partition(
+        self,
+        key: str,
+        reports: list[model.SupportDictConversible],
+        force: bool,
+        ignore_original: bool,
+    ) -> None:
+        if len(reports) == 0:
+            return
+
+        if self.skipSaveRule.match(key):
+            logger.info(
+                "key %s matched %s",
+                key,
+                self.skipSaveRule.__class__.__name__,
+            )
+            return
+
+        if ignore_original:
+            logger.info(f'ignore original json: {key}.json')
+            original = []
+        else:
+            original = self._get_original_json(key)
+
+        # マージ結果は出力フォーマットによらないので、1回だけ計算する。
+        # 変更がなければ、どのフォーマットも書き込む必要はない。
+        merger = ReportMerger()
+        merged_reports = merger.merge(reports, original)
+        if force:
+            logger.info('force option is enabled')
+        elif merged_reports == original:
+            logger.info(f'no new reports to write {key}, skip')
+            return
+
+        for outputFormat in self.formats:
+            _, ext = outputFormat.value
+            targetfile = f'{key}.{ext}'
+            logger.info(f'target file: {targetfile}')
+            processor = create_processor(outputFormat)
+            path = str(self.basepath / targetfile)
+            logger.info('report path: %s', path)
+            stream = self.fileStorage.get_output_stream(path)
+            logger.info('writing reports to %s', targetfile)
+            processor.dump(merged_reports, stream, key=key)
+            logger.info('done')
+            self.fileStorage.close_output_stream(stream)
+
+        self.saved_keys.add(key)
 
-            if self.skipSaveRule.match(key):
-                logger.info(
-                    "key %s matched %s",
+    def save(
+        self,
+        force: bool = False,
+        ignore_original: bool = False,
+        max_workers: int | None = None,
+    ):
+        """
+            max_workers を指定した場合、パーティション単位で並列に保存する。
+            各パーティションの読み書きは互いに独立しているので、fileStorage が
+            スレッドセーフであれば結果は逐次保存した場合と変わらない。
+        """
+        # self.partitions には add() で振り分けられた key しか存在しないので、
+        # 今回の reports に関係しないパーティションが読み書きされることはない。
+        if max_workers is None:
+            for key, reports in self.partitions.items():
+                self._save_partition(key, reports, force, ignore_original)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            procs = [
+                executor.submit(
+                    self._save_partition,
                     key,
-                    self.skipSaveRule.__class__.__name__,
+                    reports,
+                    force,
+                    ignore_original,
                 )
-                continue
-
-            if ignore_original:
-                logger.info(f'ignore original json: {key}.json')
-                original = []
-            else:
-                original = self._get_original_json(key)
-
-            for outputFormat in self.formats:
-                _, ext = outputFormat.value
-                targetfile = f'{key}.{ext}'
-                logger.info(f'target file: {targetfile}')
-                processor = create_processor(outputFormat)
-                merger = ReportMerger()
-                merged_reports = merger.merge(reports, original)
-                if force:
-                    logger.info('force option is enabled')
-                elif merged_reports == original:
-                    logger.info(f'no new reports to write {targetfile}, skip')
-                    continue
-                path = str(self.basepath / targetfile)
-                logger.info('report path: %s', path)
-                stream = self.fileStorage.get_output_stream(path)
-                logger.info('writing reports to %s', targetfile)
-                processor.dump(merged_reports, stream, key=key)
-                logger.info('done')
-                self.fileStorage.close_output_stream(stream)
+                for key, reports in self.partitions.items()
+            ]
+            for ft in procs:
+                # 例外を握りつぶさないように結果を取り出す
+                ft.result()
 
 
 class PageProcessorSupport(Protocol):
@@ -741,12 +786,11 @@ class JSONPageProcessor:
         stream: BinaryIO,
         **kwargs,
     ):
-        s = json.dumps(
+        # orjson は bytes (UTF-8) を直接返すので encode は不要
+        stream.write(orjson.dumps(
             merged_reports,
-            ensure_ascii=False,
             default=helper.json_serialize_helper,
-        )
-        stream.write(s.encode('UTF-8'))
+        ))
 
 
 class CSVPageProcessor:
@@ -1039,6 +1083,16 @@ class LatestDatePageBuilder:
         logger.info('building the latest page from "%s"', src)
         self.fileStorage.copy(src, dest)
 
+    def build_from(self, key: str):
+        """
+            最新の yyyy-MM-dd が既知である場合に、探索を行わずに
+            {key}.html を latest.html としてコピーする。
+        """
+        src = str(self.basepath / f'{key}.html')
+        dest = self._latest_path()
+        logger.info('building the latest page from "%s"', src)
+        self.fileStorage.copy(src, dest)
+
 
 class LatestMonthPageBuilder:
     def __init__(
@@ -1192,12 +1246,10 @@ class JSONErrorPageProcessor:
         stream: BinaryIO,
     ) -> None:
         data = [tw.as_dict() for tw in errors]
-        s = json.dumps(
+        stream.write(orjson.dumps(
             data,
-            ensure_ascii=False,
             default=helper.json_serialize_helper,
-        )
-        stream.write(s.encode('UTF-8'))
+        ))
 
 
 class HTMLErrorPageProcessor:
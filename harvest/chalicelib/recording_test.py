@@ -1,8 +1,9 @@
 import calendar
-from datetime import datetime
+from datetime import date, datetime
 
 from . import model
 from . import recording
+from . import storage
 from . import timezone
 
 
@@ -90,3 +91,38 @@ def test_PartitioningRuleBy1HRun():
     assert partitions["2023-07-01"] == [report0]
     assert partitions["2023-07-08"] == [report1, report2]
     assert partitions["2023-07-15"] == [report3]
+
+
+def test_Recorder_save_parallel(tmp_path):
+    reports = [
+        model.RunReport(
+            report_id=str(day),
+            tweet_id=None,
+            reporter="user1",
+            reporter_id="1",
+            reporter_name="",
+            chapter="キャメロット",
+            place="隠れ村",
+            runcount=10,
+            items={"ランプ": "1"},
+            note="",
+            timestamp=datetime(2023, 7, day, 12, 0, 0, tzinfo=timezone.Local),
+            source="fgodrop",
+        )
+        for day in range(1, 8)
+    ]
+    recorder = recording.Recorder(
+        partitioningRule=recording.PartitioningRuleByDate(),
+        skipSaveRule=recording.SkipSaveRuleByDate(date(2023, 7, 3)),
+        fileStorage=storage.FilesystemStorage(),
+        basedir=str(tmp_path),
+        formats=(recording.OutputFormat.JSON, recording.OutputFormat.CSV),
+    )
+    recorder.add_all(reports)
+    recorder.save(max_workers=4)
+
+    saved = sorted(p.name for p in tmp_path.iterdir())
+    assert saved == [
+        f"2023-07-0{day}.{ext}" for day in range(3, 8) for ext in ("csv", "json")
+    ]
+    assert recorder.saved_keys == {f"2023-07-0{day}" for day in range(3, 8)}
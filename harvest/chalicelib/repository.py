@@ -1,6 +1,8 @@
 import json
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from logging import getLogger
+from typing import Iterable, Iterator
 
 from . import model
 from . import storage
@@ -21,10 +23,78 @@ Twitter API から取得した報告データは TweetRepository にそのまま
 """
 
 
+# 並列 parse に切り替える tweet 数の閾値。
+# これより少ない場合はプロセス起動のオーバーヘッドの方が大きい。
+PARALLEL_PARSE_THRESHOLD = 500
+
+
 class FileNotFound(Exception):
     pass
 
 
+def _parse_one(
+    tw: twitter.TweetCopy,
+) -> model.RunReport | twitter.ParseErrorTweet:
+    """
+    ProcessPoolExecutor から呼び出せるように module level に置いている
+    """
+    try:
+        return twitter.parse_tweet(tw)
+    except twitter.TweetParseError as e:
+        return twitter.ParseErrorTweet(tweet=tw, error_message=e.get_message())
+
+
+def parse_tweets(
+    tweets: Iterable[twitter.TweetCopy],
+    max_workers: int | None = None,
+) -> tuple[list[model.RunReport], list[twitter.ParseErrorTweet]]:
+    """
+    max_workers を指定した場合は複数プロセスで parse する。
+    AWS Lambda では /dev/shm が使えないため ProcessPoolExecutor が
+    動作しない。Lambda 上では max_workers を指定しないこと。
+    max_workers を指定しない場合、tweets は1件ずつ消費されるので
+    iterator を渡せば全件をメモリ上に保持せずに済む。
+    """
+    reports: list[model.RunReport] = []
+    parseErrorTweets: list[twitter.ParseErrorTweet] = []
+
+    if max_workers is not None:
+        tweets = list(tweets)
+        if len(tweets) < PARALLEL_PARSE_THRESHOLD:
+            max_workers = None
+
+    if max_workers is None:
+        # 全件の過去ログを処理する場合はこのループが CPU 時間の大半を占めるので、
+        # ループ内で参照する関数やメソッドをあらかじめローカル変数に束縛しておく。
+        parse_tweet = twitter.parse_tweet
+        TweetParseError = twitter.TweetParseError
+        ParseErrorTweet = twitter.ParseErrorTweet
+        append_report = reports.append
+        append_error = parseErrorTweets.append
+        for tw in tweets:
+            try:
+                append_report(parse_tweet(tw))
+            except TweetParseError as e:
+                logger.debug('parse error: %s', tw.tweet_id)
+                append_error(
+                    ParseErrorTweet(tweet=tw, error_message=e.get_message())
+                )
+        return reports, parseErrorTweets
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_parse_one, tweets, chunksize=256))
+
+    ParseErrorTweet = twitter.ParseErrorTweet
+    append_report = reports.append
+    append_error = parseErrorTweets.append
+    for r in results:
+        if isinstance(r, ParseErrorTweet):
+            append_error(r)
+        else:
+            append_report(r)
+    return reports, parseErrorTweets
+
+
 class TweetRepository:
     def __init__(
         self,
@@ -82,39 +152,51 @@ class TweetRepository:
         keypath = str(basepath / key)
         return self.fileStorage.exists(keypath)
 
-    def readall(
-        self, exclude_accounts: set[str]
-    ) -> tuple[list[model.RunReport], list[twitter.ParseErrorTweet]]:
-        reports: list[model.RunReport] = []
-        parseErrorTweets: list[twitter.ParseErrorTweet] = []
+    def iter_all(self, exclude_accounts: set[str]) -> Iterator[twitter.TweetCopy]:
+        """
+        保存されている tweet をファイル単位で読み込みながら1件ずつ返す。
+        重複した tweet および exclude_accounts の tweet は除外する。
+        """
         id_cache: set[int] = set()
+        # parse_tweets と同様、全件処理時のホットループなので
+        # ループ内で参照するものはローカル変数に束縛しておく。
+        retrieve = twitter.TweetCopy.retrieve
+        add_id = id_cache.add
 
         for stream in self.fileStorage.streams(self.basedir, suffix=".json"):
             loaded = json.load(stream)
-            tweets = [twitter.TweetCopy.retrieve(e) for e in loaded]
-            logger.info(f"{len(tweets)} tweets retrieved")
-            for tw in tweets:
+            logger.info(f"{len(loaded)} tweets retrieved")
+            for e in loaded:
+                tw = retrieve(e)
                 if tw is None:
                     continue
-                if tw.tweet_id in id_cache:
-                    logger.warning("ignoring duplicate tweet: %s", tw.tweet_id)
+                tweet_id = tw.tweet_id
+                if tweet_id not in id_cache and tw.screen_name not in exclude_accounts:
+                    add_id(tweet_id)
+                    yield tw
                     continue
-                elif tw.screen_name in exclude_accounts:
+
+                # 以下は滅多に通らない
+                if tweet_id in id_cache:
+                    logger.warning("ignoring duplicate tweet: %s", tweet_id)
+                else:
                     logger.warning(
                         "ignoring exclude account's tweet: %s",
-                        tw.tweet_id,
-                    )
-                    continue
-                try:
-                    report = twitter.parse_tweet(tw)
-                except twitter.TweetParseError as e:
-                    error_tw = twitter.ParseErrorTweet(
-                        tweet=tw, error_message=e.get_message()
+                        tweet_id,
                     )
-                    parseErrorTweets.append(error_tw)
 
-                reports.append(report)
-                id_cache.add(tw.tweet_id)
+    def readall(
+        self,
+        exclude_accounts: set[str],
+        max_workers: int | None = None,
+    ) -> tuple[list[model.RunReport], list[twitter.ParseErrorTweet]]:
+        """
+        max_workers については parse_tweets を参照
+        """
+        reports, parseErrorTweets = parse_tweets(
+            self.iter_all(exclude_accounts),
+            max_workers,
+        )
 
         # 新しい順
         reports.sort(key=lambda e: e.timestamp, reverse=True)
@@ -182,14 +264,18 @@ class ReportRepository:
         keypath = str(basepath / key)
         return self.fileStorage.exists(keypath)
 
-    def readall(self) -> list[model.RunReport]:
-        all_reports: list[model.RunReport] = []
-
+    def iter_all(self) -> Iterator[model.RunReport]:
+        """
+        保存されているレポートをファイル単位で読み込みながら1件ずつ返す。
+        """
         for stream in self.fileStorage.streams(self.basedir, suffix=".json"):
             loaded = json.load(stream)
-            reports = [model.RunReport.retrieve(e) for e in loaded]
-            logger.info(f"{len(reports)} reports retrieved")
-            all_reports.extend(reports)
+            logger.info(f"{len(loaded)} reports retrieved")
+            for e in loaded:
+                yield model.RunReport.retrieve(e)
+
+    def readall(self) -> list[model.RunReport]:
+        all_reports = list(self.iter_all())
 
         # 新しい順
         all_reports.sort(key=lambda e: e.timestamp, reverse=True)
@@ -224,10 +310,12 @@ class LastReportTimeStamp:
 
     def load(self) -> tuple[str, datetime]:
         keypath = self._keypath()
-        if not self.fileStorage.exists(keypath):
+        # exists() で事前確認せずに1回の読み込みで済ませる。
+        # 空のファイルは存在しないものとは扱わず、json.loads で失敗させる。
+        text = self.fileStorage.get_as_text_if_exists(keypath)
+        if text is None:
             raise FileNotFound(keypath)
 
-        text = self.fileStorage.get_as_text(keypath)
         d = json.loads(text)
         return d["report_id"], datetime.fromisoformat(d["timestamp"])
 
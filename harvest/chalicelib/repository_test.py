@@ -0,0 +1,75 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from . import repository
+from . import storage
+
+TWEET_TEXT = """【シャーロット ゴールドラッシュ】1000周
+塵643-証487
+#FGO周回カウンタ http://aoshirobo.net/fatego/rc/
+"""
+
+
+def _tweet_dict(tweet_id: int, screen_name: str, full_text: str) -> dict:
+    return dict(
+        id=tweet_id,
+        screen_name=screen_name,
+        full_text=full_text,
+        created_at=datetime(2020, 1, 2, 3, 4, 5).isoformat(),
+    )
+
+
+def _setup_repository(tmp_path) -> repository.TweetRepository:
+    tweets = [
+        _tweet_dict(1, 'user1', TWEET_TEXT),
+        _tweet_dict(2, 'user2', 'parse error\n#FGO周回カウンタ'),
+        _tweet_dict(3, 'user3', TWEET_TEXT),
+        # duplicate
+        _tweet_dict(1, 'user1', TWEET_TEXT),
+        # excluded account
+        _tweet_dict(4, 'censored', TWEET_TEXT),
+    ]
+    (tmp_path / '20200102.json').write_text(json.dumps(tweets))
+    return repository.TweetRepository(
+        fileStorage=storage.FilesystemStorage(),
+        basedir=str(tmp_path),
+    )
+
+
+def test_readall(tmp_path):
+    repo = _setup_repository(tmp_path)
+    reports, errors = repo.readall({'censored'})
+
+    assert sorted([r.tweet_id for r in reports]) == [1, 3]
+    assert [e.tweet_id for e in errors] == [2]
+
+
+def test_readall_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(repository, 'PARALLEL_PARSE_THRESHOLD', 1)
+    repo = _setup_repository(tmp_path)
+    reports, errors = repo.readall({'censored'}, max_workers=2)
+
+    assert sorted([r.tweet_id for r in reports]) == [1, 3]
+    assert [e.tweet_id for e in errors] == [2]
+
+
+def test_LastReportTimeStamp_load(tmp_path):
+    ts = repository.LastReportTimeStamp(
+        fileStorage=storage.FilesystemStorage(),
+        basedir=str(tmp_path),
+        key='last_report.json',
+    )
+    # 存在しない場合のみ FileNotFound
+    with pytest.raises(repository.FileNotFound):
+        ts.load()
+
+    # 空のファイルは壊れているものとして失敗させる
+    (tmp_path / 'last_report.json').write_text('')
+    with pytest.raises(json.JSONDecodeError):
+        ts.load()
+
+    t = datetime(2023, 7, 5, 23, 59, 59)
+    ts.save('1', t)
+    assert ts.load() == ('1', t)
@@ -1,14 +1,31 @@
+import gzip
+import hashlib
 import io
 import pathlib
 import shutil
+import threading
 from logging import getLogger
-from typing import BinaryIO, Iterator, Protocol
+from typing import cast, BinaryIO, Iterator, Protocol
 
 import boto3  # type: ignore
+import botocore.config  # type: ignore
 import botocore.exceptions  # type: ignore
 
 logger = getLogger(__name__)
 
+# 1つの AmazonS3Storage をスレッド間で共有して並列に読み書きすることを
+# 想定し、コネクションプールを既定値 (10) より大きめにとっておく。
+s3_config = botocore.config.Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+)
+
+# gzip 圧縮して保存する Content-Type
+compressible_content_types = ('application/json', 'text/csv')
+# 保存時の CPU コストを抑えるため最速の圧縮レベルを使う。
+# JSON/CSV であればこれでも十分に小さくなる。
+gzip_compresslevel = 1
+
 
 class SupportStorage(Protocol):
     def list(
@@ -28,6 +45,13 @@ class SupportStorage(Protocol):
     def get_as_binary(self, path: str) -> bytes:
         ...
 
+    def get_as_text_if_exists(self, path: str) -> str | None:
+        """
+            get_as_text と異なり、存在しない場合は None を返す。
+            空のファイルと存在しないファイルを区別したい場合に使う。
+        """
+        ...
+
     def get_output_stream(self, path: str, append: bool = False) -> BinaryIO:
         ...
 
@@ -79,6 +103,13 @@ class FilesystemStorage:
         with open(path, 'rb') as fp:
             return fp.read()
 
+    def get_as_text_if_exists(self, path: str) -> str | None:
+        try:
+            with open(path) as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
     def get_output_stream(self, path: str, append: bool = False) -> BinaryIO:
         if append:
             return open(path, 'ab')
@@ -115,11 +146,28 @@ class AmazonS3Storage:
     def __init__(
         self,
         bucket: str,
+        compress: bool = False,
+        cachedir: str | None = None,
     ):
-        self.s3 = boto3.resource('s3')
-        self.s3client = boto3.client('s3')
-        self.bucket = self.s3.Bucket(bucket)
+        """
+            compress が True の場合、JSON/CSV を ContentEncoding: gzip として
+            圧縮して保存する。読み込み時は compress の値によらず、
+            ContentEncoding を見て透過的に展開する。
+
+            cachedir を指定した場合、読み書きしたオブジェクトを ETag とともに
+            cachedir に保存しておき、次回の読み込み時には If-None-Match で
+            変更がないことを確認できればキャッシュを使う。Lambda の /tmp は
+            warm start の間は保持されるので、頻繁に読まれる小さな設定ファイル
+            向け。
+        """
+        self.compress = compress
+        self.cachedir = pathlib.Path(cachedir) if cachedir else None
+        # boto3 の resource はスレッドセーフではないので、スレッド間で
+        # 共有しても問題ない client のみを使う。
+        self.s3client = boto3.client('s3', config=s3_config)
+        self.bucket_name = bucket
         self.key_stream_pairs: dict[str, BinaryIO] = {}
+        self.lock = threading.Lock()
 
     def list(
         self,
@@ -128,16 +176,18 @@ class AmazonS3Storage:
         suffix: str = '',
     ) -> Iterator[str]:
         prefix = f"{basedir}/{prefix}"
-        object_summaries = self.bucket.objects.filter(Prefix=prefix)
+        paginator = self.s3client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
 
-        for entry in object_summaries:
-            if entry.key.endswith(suffix):
-                yield entry.key
+        for page in pages:
+            for entry in page.get('Contents', []):
+                if entry['Key'].endswith(suffix):
+                    yield entry['Key']
 
     def exists(self, path: str) -> bool:
         try:
             self.s3client.head_object(
-                Bucket=self.bucket.name,
+                Bucket=self.bucket_name,
                 Key=path,
             )
             return True
@@ -148,20 +198,81 @@ class AmazonS3Storage:
             # Unexpceted Error
             raise
 
-    def _get_object(self, path: str) -> bytes:
-        logger.info(f'get s3://{self.bucket.name}/{path}')
-        if not self.exists(path):
-            return b''
+    def _cache_files(self, path: str) -> tuple[pathlib.Path, pathlib.Path]:
+        assert self.cachedir is not None
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return self.cachedir / name, self.cachedir / f'{name}.etag'
 
-        bio = io.BytesIO()
-        self.bucket.download_fileobj(path, bio)
-        return bio.getvalue()
+    def _read_cache(self, path: str) -> tuple[str, bytes] | None:
+        if self.cachedir is None:
+            return None
+        datafile, etagfile = self._cache_files(path)
+        try:
+            return etagfile.read_text(), datafile.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, path: str, etag: str, data: bytes) -> None:
+        if self.cachedir is None:
+            return
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        datafile, etagfile = self._cache_files(path)
+        # etag を後に書くことで、data の書き込み途中で中断されても
+        # 古い etag と新しい data の組み合わせが使われないようにする。
+        etagfile.unlink(missing_ok=True)
+        datafile.write_bytes(data)
+        etagfile.write_text(etag)
+
+    def _delete_cache(self, path: str) -> None:
+        if self.cachedir is None:
+            return
+        for f in self._cache_files(path):
+            f.unlink(missing_ok=True)
+
+    def _get_object(self, path: str) -> bytes | None:
+        """
+            存在しない場合は None を返す
+        """
+        logger.info(f'get s3://{self.bucket_name}/{path}')
+        cached = self._read_cache(path)
+        kwargs = {}
+        if cached:
+            kwargs['IfNoneMatch'] = cached[0]
+
+        # exists() で事前確認すると HEAD + GET の2往復になるので、
+        # GET のみ発行して NoSuchKey を存在しないものとして扱う。
+        try:
+            resp = self.s3client.get_object(
+                Bucket=self.bucket_name,
+                Key=path,
+                **kwargs,
+            )
+        except botocore.exceptions.ClientError as e:
+            code = e.response['Error']['Code']
+            if cached and code in ('304', 'NotModified'):
+                logger.info(f'not modified, use cache: {path}')
+                return cached[1]
+            if code == 'NoSuchKey':
+                self._delete_cache(path)
+                return None
+            # Unexpceted Error
+            raise
+        data = resp['Body'].read()
+        if resp.get('ContentEncoding') == 'gzip':
+            data = gzip.decompress(data)
+        self._write_cache(path, resp['ETag'], data)
+        return data
 
     def get_as_text(self, path: str) -> str:
-        return self._get_object(path).decode('utf-8')
+        return self.get_as_binary(path).decode('utf-8')
 
     def get_as_binary(self, path: str) -> bytes:
-        return self._get_object(path)
+        data = self._get_object(path)
+        return data if data is not None else b''
+
+    def get_as_text_if_exists(self, path: str) -> str | None:
+        data = self._get_object(path)
+        return data.decode('utf-8') if data is not None else None
 
     def get_output_stream(self, path: str, append: bool = False) -> BinaryIO:
         bio = io.BytesIO()
@@ -172,14 +283,22 @@ class AmazonS3Storage:
 
         # この時点で key を記憶しておかないと後で stream を渡された
         # ときに対応する key を復元できなくなる。
-        self.key_stream_pairs[path] = bio
+        with self.lock:
+            self.key_stream_pairs[path] = bio
         return bio
 
+    def _pop_stream_key(self, stream: BinaryIO) -> str | None:
+        with self.lock:
+            for s3key, bio in self.key_stream_pairs.items():
+                if bio is stream:
+                    # put 後は不要になるので、ここで取り除いておく
+                    del self.key_stream_pairs[s3key]
+                    return s3key
+        return None
+
     def close_output_stream(self, stream: BinaryIO) -> None:
-        for s3key, bio in self.key_stream_pairs.items():
-            if bio is not stream:
-                continue
-            obj = self.bucket.Object(s3key)
+        s3key = self._pop_stream_key(stream)
+        if s3key is not None:
             if s3key.endswith('.json'):
                 content_type = 'application/json'
             elif s3key.endswith('.html'):
@@ -191,14 +310,28 @@ class AmazonS3Storage:
             else:
                 content_type = 'application/octet-stream'
             logger.info(
-                f'put s3://{self.bucket.name}/{s3key}, '
+                f'put s3://{self.bucket_name}/{s3key}, '
                 f'content_type={content_type}'
             )
-            bio.seek(0)
-            obj.upload_fileobj(
-                stream,
-                ExtraArgs={'ContentType': content_type},
+            # 出力はすべてメモリ上にあり、サイズも multipart upload が
+            # 必要になるほど大きくないので、1回の PUT で済ませる。
+            stream.seek(0)
+            data = stream.read()
+            body = data
+            extra_args = {}
+            if self.compress and content_type in compressible_content_types:
+                body = gzip.compress(data, compresslevel=gzip_compresslevel)
+                extra_args['ContentEncoding'] = 'gzip'
+            resp = self.s3client.put_object(
+                Bucket=self.bucket_name,
+                Key=s3key,
+                Body=body,
+                ContentType=content_type,
+                **extra_args,
             )
+            # 書き込んだ内容はわかっているので、次回の読み込みに備えて
+            # キャッシュも更新しておく。
+            self._write_cache(s3key, resp['ETag'], data)
             stream.close()
             return
         raise ValueError('could not put a stream object to S3')
@@ -207,8 +340,14 @@ class AmazonS3Storage:
         return pathlib.PurePosixPath(basedir)
 
     def copy(self, src: str, dest: str) -> None:
-        source = {'Bucket': self.bucket.name, 'Key': src}
-        self.bucket.copy(source, dest)
+        # コピー対象は小さな HTML のみなので、managed transfer を使わずに
+        # CopyObject を1回発行するだけで済ませる (メタデータもコピーされる)。
+        logger.info(f'copy s3://{self.bucket_name}/{src} -> {dest}')
+        self.s3client.copy_object(
+            Bucket=self.bucket_name,
+            Key=dest,
+            CopySource={'Bucket': self.bucket_name, 'Key': src},
+        )
 
     def streams(
         self,
@@ -216,14 +355,20 @@ class AmazonS3Storage:
         prefix: str = '',
         suffix: str = '',
     ) -> Iterator[BinaryIO]:
-        prefix = f"{basedir}/{prefix}"
-        object_summaries = self.bucket.objects.filter(Prefix=prefix)
-
-        for entry in object_summaries:
-            if entry.key.endswith(suffix):
-                logger.info(f'get s3://{self.bucket.name}/{entry.key}')
-                resp = entry.get()
+        for key in self.list(basedir, prefix, suffix):
+            logger.info(f'get s3://{self.bucket_name}/{key}')
+            resp = self.s3client.get_object(
+                Bucket=self.bucket_name,
+                Key=key,
+            )
+            if resp.get('ContentEncoding') == 'gzip':
+                yield cast(BinaryIO, gzip.GzipFile(fileobj=resp['Body']))
+            else:
                 yield resp['Body']
 
     def delete(self, path: str) -> None:
-        self.bucket.Object(path).delete()
+        self.s3client.delete_object(
+            Bucket=self.bucket_name,
+            Key=path,
+        )
+        self._delete_cache(path)
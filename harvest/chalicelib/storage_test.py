@@ -0,0 +1,161 @@
+import gzip
+import io
+
+from botocore.response import StreamingBody  # type: ignore
+from botocore.stub import Stubber  # type: ignore
+
+from . import storage
+
+BUCKET = 'test-bucket'
+
+
+def _body(data: bytes) -> StreamingBody:
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+class _Gzipped:
+    """
+        expected_params 用。gzip ヘッダには時刻が入るので展開して比較する。
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __eq__(self, other) -> bool:
+        return gzip.decompress(other) == self.data
+
+
+def test_AmazonS3Storage_list_and_streams():
+    st = storage.AmazonS3Storage(BUCKET)
+    with Stubber(st.s3client) as stubber:
+        # list はページをまたいで key を返す。
+        # streams は key を1つずつ get するので呼び出しは交互になる。
+        stubber.add_response(
+            'list_objects_v2',
+            {
+                'Contents': [{'Key': 'dir/a.json'}, {'Key': 'dir/a.txt'}],
+                'IsTruncated': True,
+                'NextContinuationToken': 'token',
+            },
+            {'Bucket': BUCKET, 'Prefix': 'dir/'},
+        )
+        stubber.add_response(
+            'get_object',
+            {'Body': _body(b'[1]')},
+            {'Bucket': BUCKET, 'Key': 'dir/a.json'},
+        )
+        stubber.add_response(
+            'list_objects_v2',
+            {
+                'Contents': [{'Key': 'dir/b.json'}],
+                'IsTruncated': False,
+            },
+            {'Bucket': BUCKET, 'Prefix': 'dir/', 'ContinuationToken': 'token'},
+        )
+        stubber.add_response(
+            'get_object',
+            {'Body': _body(gzip.compress(b'[2]')), 'ContentEncoding': 'gzip'},
+            {'Bucket': BUCKET, 'Key': 'dir/b.json'},
+        )
+
+        contents = [s.read() for s in st.streams('dir', suffix='.json')]
+        assert contents == [b'[1]', b'[2]']
+        stubber.assert_no_pending_responses()
+
+
+def test_AmazonS3Storage_etag_cache(tmp_path):
+    st = storage.AmazonS3Storage(BUCKET, cachedir=str(tmp_path))
+    path = 'settings/a.json'
+    with Stubber(st.s3client) as stubber:
+        # put した内容と ETag がキャッシュされる
+        stubber.add_response(
+            'put_object',
+            {'ETag': '"etag1"'},
+            {
+                'Bucket': BUCKET,
+                'Key': path,
+                'Body': b'{"a": 1}',
+                'ContentType': 'application/json',
+            },
+        )
+        # キャッシュの ETag で問い合わせ、304 ならキャッシュを使う
+        stubber.add_client_error(
+            'get_object',
+            service_error_code='304',
+            http_status_code=304,
+            expected_params={'Bucket': BUCKET, 'Key': path, 'IfNoneMatch': '"etag1"'},
+        )
+        # 更新されていれば新しい内容でキャッシュを置き換える
+        stubber.add_response(
+            'get_object',
+            {'Body': _body(b'{"a": 2}'), 'ETag': '"etag2"'},
+            {'Bucket': BUCKET, 'Key': path, 'IfNoneMatch': '"etag1"'},
+        )
+        # 削除されていればキャッシュも捨てる
+        stubber.add_client_error(
+            'get_object',
+            service_error_code='NoSuchKey',
+            http_status_code=404,
+            expected_params={'Bucket': BUCKET, 'Key': path, 'IfNoneMatch': '"etag2"'},
+        )
+        stubber.add_client_error(
+            'get_object',
+            service_error_code='NoSuchKey',
+            http_status_code=404,
+            expected_params={'Bucket': BUCKET, 'Key': path},
+        )
+
+        stream = st.get_output_stream(path)
+        stream.write(b'{"a": 1}')
+        st.close_output_stream(stream)
+        assert st._read_cache(path) == ('"etag1"', b'{"a": 1}')
+
+        assert st.get_as_text(path) == '{"a": 1}'
+
+        assert st.get_as_text(path) == '{"a": 2}'
+        assert st._read_cache(path) == ('"etag2"', b'{"a": 2}')
+
+        assert st.get_as_text_if_exists(path) is None
+        assert st._read_cache(path) is None
+
+        assert st.get_as_binary(path) == b''
+        stubber.assert_no_pending_responses()
+
+
+def test_AmazonS3Storage_compress(tmp_path):
+    st = storage.AmazonS3Storage(BUCKET, compress=True, cachedir=str(tmp_path))
+    json_data = b'{"a": 1}'
+    html_data = b'<html></html>'
+    with Stubber(st.s3client) as stubber:
+        # JSON は gzip 圧縮して ContentEncoding をつける
+        stubber.add_response(
+            'put_object',
+            {'ETag': '"etag1"'},
+            {
+                'Bucket': BUCKET,
+                'Key': 'out/a.json',
+                'Body': _Gzipped(json_data),
+                'ContentType': 'application/json',
+                'ContentEncoding': 'gzip',
+            },
+        )
+        # HTML は圧縮しない
+        stubber.add_response(
+            'put_object',
+            {'ETag': '"etag2"'},
+            {
+                'Bucket': BUCKET,
+                'Key': 'out/index.html',
+                'Body': html_data,
+                'ContentType': 'text/html',
+            },
+        )
+
+        for path, data in (('out/a.json', json_data), ('out/index.html', html_data)):
+            stream = st.get_output_stream(path)
+            stream.write(data)
+            st.close_output_stream(stream)
+        stubber.assert_no_pending_responses()
+
+    # キャッシュには圧縮前の内容が入る
+    assert st._read_cache('out/a.json') == ('"etag1"', json_data)
+    assert st._read_cache('out/index.html') == ('"etag2"', html_data)
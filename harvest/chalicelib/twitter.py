@@ -521,7 +521,7 @@ def parse_tweet(tweet: TweetCopy) -> model.RunReport:
         if token.endswith('NaN'):
             item = token[:-3]
             item_dict[item] = 'NaN'
-            logger.debug(f'{item}: NaN')
+            logger.debug('%s: NaN', item)
             continue
 
         # 末尾の () 表記はカットし、なかったものとして扱う。
@@ -572,9 +572,6 @@ class StatusTweetURLParser:
 
         for url in urls:
             user, tweet_id = self.parse(url)
-            if user not in d:
-                d[user] = [tweet_id]
-            else:
-                d[user].append(tweet_id)
+            d.setdefault(user, []).append(tweet_id)
 
         return d
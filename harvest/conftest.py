@@ -0,0 +1,5 @@
+import os
+
+# app.py はモジュールの読み込み時に boto3 client を生成するので、
+# テスト環境でも region を決めておく (実際の通信は Stubber で差し替える)。
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
@@ -244,7 +244,10 @@ def command_rebuild(args: argparse.Namespace) -> None:
     tweet_repository = setup_tweet_repository(args.output_dir)
     report_reporitory = setup_report_repository(args.output_dir)
     censored_accounts = setup_censored_accounts()
-    tweet_reports, parse_error_tweets = tweet_repository.readall(set(censored_accounts.list()))
+    tweet_reports, parse_error_tweets = tweet_repository.readall(
+        set(censored_accounts.list()),
+        max_workers=os.cpu_count(),
+    )
     report_reports = report_reporitory.readall()
 
     # マージして新しい順に並べる
@@ -280,7 +283,11 @@ def command_build(args: argparse.Namespace) -> None:
         logger.info('no reports')
         return
 
-    if len(reports) == 1 and last_report_id == reports[0].report_id:
+    # timestamp が since と一致するレポート (= 前回取得済みの最新レポート) も
+    # 取得されるので取り除いておく。残しておくと quest list の countup が
+    # 重複してしまう。
+    reports = [r for r in reports if r.report_id != last_report_id]
+    if len(reports) == 0:
         logger.info('no new reports')
         return
 